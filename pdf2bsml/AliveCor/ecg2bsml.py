@@ -54,26 +54,423 @@ S
 
 #==============================================================================
 
+import re
+
 import numpy as np
 import pypdf
 
+try:
+  from ecg2bsml_scan import scan_bytes   # Built from ``ecg2bsml_scan.pyx``
+except ImportError:
+  scan_bytes = None
+
 #==============================================================================
 
 POINTS2MM = 25.4/72.0
 
+T_SCALE = 25.0   # mm/s
+V_SCALE = 10.0   # mm/mV
+
+IDENTITY = (1.0, 1.0, 0.0, 0.0)   # Graphics transform as (Sx, Sy, Tx, Ty)
+
+#==============================================================================
+
+# A content stream token is either a number or some other whitespace delimited
+# sequence (an operator, name, string fragment, etc).
+_TOKEN_RE = re.compile(rb'([-+]?(?:\d+\.?\d*|\.\d+))(?!\S)|(\S+)')
+
+(OP_q, OP_Q, OP_BT, OP_ET, OP_cm, OP_w, OP_m, OP_l, OP_PAINT) = range(9)
+OP_OTHER = -1
+
+_OPERATORS = { b'q':  OP_q,
+               b'Q':  OP_Q,
+               b'BT': OP_BT,
+               b'ET': OP_ET,
+               b'cm': OP_cm,
+               b'w':  OP_w,
+               b'm':  OP_m,
+               b'l':  OP_l,
+               # Path painting operators end a path
+               b'S':  OP_PAINT,  b's':  OP_PAINT,
+               b'f':  OP_PAINT,  b'F':  OP_PAINT,  b'f*': OP_PAINT,
+               b'B':  OP_PAINT,  b'B*': OP_PAINT,  b'b':  OP_PAINT,  b'b*': OP_PAINT,
+               b'n':  OP_PAINT,
+             }
+
+#==============================================================================
+
+def _tokenize(data):
+#===================
+  '''
+  Split a content stream into operator codes and numeric parameters.
+
+  The parameters of the ``i``-th operator are ``nums[num_idx[i]:num_idx[i+1]]``.
+  '''
+  op_ids = [ ]
+  nums = [ ]
+  num_idx = [ 0 ]
+  for (number, operator) in _TOKEN_RE.findall(data):
+    if number:
+      nums.append(float(number))
+    else:
+      op_ids.append(_OPERATORS.get(operator, OP_OTHER))
+      num_idx.append(len(nums))
+  return (np.fromiter(op_ids, dtype=np.int8, count=len(op_ids)),
+          np.fromiter(nums, dtype=np.float64, count=len(nums)),
+          np.fromiter(num_idx, dtype=np.int32, count=len(num_idx)))
+
+
+def _interpret(op_ids, nums, num_idx):
+#=====================================
+  '''
+  The state machine of :class:`_Scanner`, over the arrays from :func:`_tokenize`.
+
+  Written for compilation with Numba, so state is kept in scalars and
+  preallocated arrays rather than Python objects.
+  '''
+  n = op_ids.size
+  times = np.empty(n, np.float64)
+  trace = np.empty(n, np.float64)
+  beats = np.empty(n, np.float64)
+  origins_trace = np.empty(n, np.float64)
+  origins_beats = np.empty(n, np.float64)
+  graphicstate = np.empty((64, 4), np.float64)
+  (Sx, Sy, Tx, Ty) = IDENTITY
+  depth = 0
+  stage = 0
+  level = 0
+  linestate = 0
+  subtrace = -1
+  (ntimes, nbeats, ntrace_origins, nbeat_origins) = (0, 0, 0, 0)
+  X_min = 0.0
+  T_width = 0.0
+  have_width = False
+  t_start = 0.0
+  started = False
+
+  for i in range(n):
+    op = op_ids[i]
+    p = num_idx[i]
+    nparams = num_idx[i+1] - p
+    if   op == OP_l:
+      assert nparams == 2
+      x = Sx*nums[p] + Tx
+      y = Sy*nums[p+1] + Ty
+      if   linestate == 1:   # Border
+        if not have_width:
+          T_width = x - X_min
+          have_width = True
+      elif linestate == 22:  # In trace
+        assert 0 <= subtrace < ntrace_origins
+        times[ntimes] = x - t_start
+        trace[ntimes] = y - origins_trace[subtrace]
+        ntimes += 1
+
+    elif op == OP_q:
+      if depth == graphicstate.shape[0]:
+        graphicstate = np.concatenate((graphicstate, np.empty_like(graphicstate)))
+      graphicstate[depth, 0] = Sx
+      graphicstate[depth, 1] = Sy
+      graphicstate[depth, 2] = Tx
+      graphicstate[depth, 3] = Ty
+      depth += 1
+      (Sx, Sy, Tx, Ty) = IDENTITY
+      if level == 0: stage += 1
+      level += 1
+
+    elif op == OP_Q:
+      assert depth > 0
+      depth -= 1
+      Sx = graphicstate[depth, 0]
+      Sy = graphicstate[depth, 1]
+      Tx = graphicstate[depth, 2]
+      Ty = graphicstate[depth, 3]
+      if linestate: linestate += 1
+      level -= 1
+
+    elif op == OP_cm:
+      assert nparams == 6 and nums[p+1] == 0 and nums[p+2] == 0
+      Sx = nums[p]
+      Sy = nums[p+3]
+      Tx = nums[p+4]
+      Ty = nums[p+5]
+
+    elif op == OP_w:
+      assert nparams == 1
+      w = nums[p]
+      if   stage == 2:
+        if   w == 0.4:  # Plot border followed by beat marker grid
+          linestate = 1
+        elif w == 0.3:  # Vertical grid followed by trace grid
+          linestate = 11
+      elif stage == 3:
+        if   w == 1.5:  # Calibration pulse
+          linestate = 21
+        elif w == 0.4:  # Trace
+          subtrace += 1
+          linestate = 22
+        elif w == 0.6:  # Beat marker
+          linestate = 23
+
+    elif op == OP_m:
+      assert nparams == 2
+      x = Sx*nums[p] + Tx
+      y = Sy*nums[p+1] + Ty
+      if   linestate == 1:   # Border
+        X_min = x
+      elif linestate == 2:   # Beat grid
+        origins_beats[nbeat_origins] = y
+        nbeat_origins += 1
+      elif linestate == 12:  # Trace grid
+        origins_trace[ntrace_origins] = y
+        ntrace_origins += 1
+      elif linestate == 22:  # In trace
+        assert 0 <= subtrace < ntrace_origins
+        if not started:
+          t_start = x
+          started = True
+          times[ntimes] = 0.0
+        else:
+          assert have_width
+          t_start -= T_width
+          times[ntimes] = x - t_start
+        trace[ntimes] = y - origins_trace[subtrace]
+        ntimes += 1
+      elif linestate >= 23:  # Beat markers
+        assert started
+        beats[nbeats] = x - t_start
+        nbeats += 1
+
+  return (times[:ntimes], trace[:ntimes], beats[:nbeats])
+
+_jit_interpreter = None
+
+def _jit_interpret():
+#====================
+  '''
+  :func:`_interpret` compiled by Numba, or ``None`` if Numba isn't installed.
+
+  Numba is only imported, and the kernel compiled or loaded from its cache,
+  on first use, as this costs far more than scanning a single PDF.
+  '''
+  global _jit_interpreter
+  if _jit_interpreter is None:
+    try:
+      import numba
+    except ImportError:
+      return None
+    _jit_interpreter = numba.njit(cache=True)(_interpret)
+  return _jit_interpreter
+
 #==============================================================================
 
-class GraphicsMap(object):
-#=========================
+class _Scanner(object):
+#======================
 
-  def __init__(self, Sx=1, Sy=1, Tx=0, Ty=0):
-  #------------------------------------------
-    self._matrix = [Sx, Sy, Tx, Ty]
+  '''
+  Interpret the operators in a page's content stream, given as ``bytes``,
+  collecting trace and beat values in preallocated buffers.
 
-  def map(self, point):
+  The points of a path are collected untransformed and then mapped and
+  routed as arrays when the path is painted.
+  '''
+  def __init__(self, data):
+  #------------------------
+    self._tokens = _TOKEN_RE.finditer(data)
+    self.params = [ 0.0 ]*6   # Operator parameters, in fixed slots
+    self.nparams = 0
+    self.graphicstate = [ ]
+    self.path = [ ]
+    self.moves = [ ]     # Indices into ``path`` of ``m`` points
+    self.origins_trace = [ ]
+    self.origins_beats = [ ]
+    self.stage = 0
+    self.level = 0
+    self.intext = False
+    self.transform = IDENTITY
+    self.linestate = 0
+    self.X_min = None
+    self.X_max = None
+    self.T_width = None
+    self.t_start = None
+    self.subtrace = -1
+    self.times = np.empty(4096, np.float64)   # Trace buffers, of which
+    self.trace = np.empty(4096, np.float64)   # the first ``ntimes`` are used
+    self.ntimes = 0
+    self.beats = np.empty(256, np.float64)
+    self.nbeats = 0
+
+  def run(self):
+  #-------------
+    '''
+    :return: A tuple of ``times``, ``trace`` and ``beats`` arrays, in points.
+    '''
+    params = self.params
+    nparams = 0
+
+    for token in self._tokens:
+      (number, operator) = token.groups()
+      if number is not None:
+        if nparams < 6: params[nparams] = float(number)
+        nparams += 1
+        continue
+      handler = _DISPATCH.get(operator)
+      if handler is not None:
+        self.nparams = nparams
+        handler(self)
+      nparams = 0
+
+    return (self.times[:self.ntimes], self.trace[:self.ntimes], self.beats[:self.nbeats])
+
+  def push(self, times, trace, t_origin=0.0, y_origin=0.0):
+  #---------------------------------------------------------
+    # Origins are subtracted in place, after copying into the buffers
+    n = self.ntimes + len(times)
+    if n > len(self.times):
+      size = max(2*len(self.times), n)
+      self.times = np.resize(self.times, size)
+      self.trace = np.resize(self.trace, size)
+    self.times[self.ntimes:n] = times
+    self.times[self.ntimes:n] -= t_origin
+    self.trace[self.ntimes:n] = trace
+    self.trace[self.ntimes:n] -= y_origin
+    self.ntimes = n
+
+  def push_beats(self, beats):
+  #---------------------------
+    n = self.nbeats + len(beats)
+    if n > len(self.beats):
+      self.beats = np.resize(self.beats, max(2*len(self.beats), n))
+    self.beats[self.nbeats:n] = beats
+    self.nbeats = n
+
+  def skip_block(self):
   #--------------------
-    return (float(self._matrix[0])*point[0] + self._matrix[2],
-            float(self._matrix[1])*point[1] + self._matrix[3])
+    # Fast-forward to the end of the block just opened, only
+    # keeping track of nested blocks
+    depth = 1
+    for token in self._tokens:
+      operator = token.group(2)
+      if   operator == b'q':
+        depth += 1
+      elif operator == b'Q':
+        depth -= 1
+        if depth == 0: break
+        if self.linestate: self.linestate += 1
+    self.op_Q()
+
+  def op_l(self):
+  #--------------
+    assert(self.nparams == 2)
+    params = self.params
+    self.path.append((params[0], params[1]))
+
+  def op_m(self):
+  #--------------
+    assert(self.nparams == 2)
+    params = self.params
+    self.moves.append(len(self.path))
+    self.path.append((params[0], params[1]))
+
+  def op_paint(self):
+  #------------------
+    path = self.path
+    moves = self.moves
+    if not path: return
+    assert(moves and moves[0] == 0)
+    pts = np.array(path, dtype=np.float64)
+    (Sx, Sy, Tx, Ty) = self.transform
+    pts[:, 0] *= Sx
+    pts[:, 0] += Tx
+    pts[:, 1] *= Sy
+    pts[:, 1] += Ty
+    (xs, ys) = (pts[:, 0], pts[:, 1])
+    linestate = self.linestate
+    if   linestate == 1:   # Border
+      if len(moves) < len(path):
+        if self.T_width is None:
+          first_line = next(n for n in range(len(path)) if n not in moves)
+          self.X_min = xs[first_line - 1]
+          self.X_max = xs[first_line]
+          self.T_width = self.X_max - self.X_min
+      else:
+        self.X_min = xs[moves[-1]]
+    elif linestate == 2:   # Beat grid
+      self.origins_beats.extend(ys[moves])
+    elif linestate == 12:  # Trace grid
+      self.origins_trace.extend(ys[moves])
+    elif linestate == 22:  # In trace
+      ends = moves[1:] + [ len(path) ]
+      for (start, end) in zip(moves, ends):
+        if self.t_start is None:
+          self.t_start = xs[start]
+        else:
+          self.t_start -= self.T_width
+        self.push(xs[start:end], ys[start:end],
+                  self.t_start, self.origins_trace[self.subtrace])
+    elif linestate >= 23:  # Beat markers
+      self.push_beats(xs[moves] - self.t_start)
+    path.clear()
+    moves.clear()
+
+  def op_q(self):
+  #--------------
+    self.graphicstate.append(self.transform)
+    self.transform = IDENTITY
+    if self.level == 0: self.stage += 1
+    self.level += 1
+    if self.level > 1 and self.linestate == 11:   # The vertical grid isn't used
+      self.skip_block()
+
+  def op_Q(self):
+  #--------------
+    self.transform = self.graphicstate.pop()
+    if self.linestate: self.linestate += 1
+    self.level -= 1
+
+  def op_BT(self):
+  #---------------
+    self.intext = True
+
+  def op_ET(self):
+  #---------------
+    self.intext = False
+
+  def op_cm(self):
+  #---------------
+    params = self.params
+    assert(self.nparams == 6 and params[1] == 0 and params[2] == 0)
+    self.transform = (params[0], params[3], params[4], params[5])
+
+  def op_w(self):
+  #--------------
+    assert(self.nparams == 1)
+    w = self.params[0]
+    if   self.stage == 2:
+      if   w == 0.4:  # Plot border followed by beat marker grid
+        self.linestate = 1
+      elif w == 0.3:  # Vertical grid followed by trace grid
+        self.linestate = 11
+    elif self.stage == 3:
+      if   w == 1.5:  # Calibration pulse
+        # 1mV for 0.2s
+        self.linestate = 21
+      elif w == 0.4:  # Trace
+        self.subtrace += 1
+        self.linestate = 22
+      elif w == 0.6:  # Beat marker
+        self.linestate = 23
+
+
+_HANDLERS = { OP_q: _Scanner.op_q,   OP_Q: _Scanner.op_Q,
+              OP_BT: _Scanner.op_BT, OP_ET: _Scanner.op_ET,
+              OP_cm: _Scanner.op_cm, OP_w: _Scanner.op_w,
+              OP_m: _Scanner.op_m,   OP_l: _Scanner.op_l,
+              OP_PAINT: _Scanner.op_paint,
+            }
+
+# Operator handlers, built once, keyed by operator bytes
+_DISPATCH = { operator: _HANDLERS[op] for (operator, op) in _OPERATORS.items() }
 
 #==============================================================================
 
@@ -182,127 +579,45 @@ class ECG_PDF(object):
     h f
 
   '''
-  def __init__(self, pdf_file):
-  #----------------------------
-    self._reader = pypdf.PdfReader(pdf_file)
-    self._page = self._reader.pages[0]
+  def __init__(self, pdf_file, use_numba=False):
+  #---------------------------------------------
+    # ``use_numba`` selects the Numba kernel when ``scan_bytes`` isn't built
     self._bounds = [0.0, 0.0,  0.0, 0.0]   # x, y, w, h
     self._text = [ ]
-    self._ecg = None
-    self._beats = None
-    self._scan(self._page.get_contents().get_data().decode('utf-8'))
+    # Only the first page's content stream is needed, so get it and
+    # then close the file, without keeping the reader
+    with open(pdf_file, 'rb') as f:
+      page = pypdf.PdfReader(f, strict=False).pages[0]
+      contents = page['/Contents'].get_object()
+      if isinstance(contents, pypdf.generic.StreamObject):
+        data = contents.get_data()   # Decoded bytes, without a ContentStream copy
+      else:
+        data = page.get_contents().get_data()
+    if scan_bytes is not None:
+      self._set_ecg(*scan_bytes(data))
+    elif use_numba and _jit_interpret() is not None:
+      self._set_ecg(*_jit_interpret()(*_tokenize(data)))
+    else:
+      self._scan(data)
+
+
+  def _set_ecg(self, times, trace, beats):
+  #---------------------------------------
+    # Scale by float64 scalars so there is no type promotion. The scanners
+    # return views of larger buffers, so scaling into new arrays means
+    # that the buffers aren't kept.
+    t_factor = np.float64(POINTS2MM/T_SCALE)
+    v_factor = np.float64(POINTS2MM/V_SCALE)
+    times = np.multiply(times, t_factor, dtype=np.float64)
+    trace = np.multiply(trace, v_factor, dtype=np.float64)
+    beats = np.multiply(beats, t_factor, dtype=np.float64)
+    self.ecg = (times, trace)
+    self.beats = beats
 
 
   def _scan(self, data):
   #---------------------
-    stage = 0
-    level = 0
-    intext = False
-    params = [ ]
-    transform = GraphicsMap()
-    graphicstate = [ ]
-    linestate = 0
-    X_min = None
-    X_max = None
-    T_width = None
-    t_start = None
-    subtrace = -1
-    origins_trace = [ ]
-    origins_beats = [ ]
-    times = [ ]
-    trace = [ ]
-    beats = [ ]
-    T_scale = 25.0   # mm/s
-    V_scale = 10.0   # mm/mV
-
-    for d in data.split():
-      v = None
-      try: v = int(d)
-      except ValueError:
-        try: v = float(d)
-        except ValueError: pass
-      if v is not None:
-        params.append(v)
-        continue
-
-      if   d == 'q':
-        graphicstate.append(transform)
-        transform = GraphicsMap()
-        if level == 0: stage += 1
-        level += 1
-
-      elif d == 'Q':
-        transform = graphicstate.pop()
-        if linestate: linestate += 1
-        level -= 1
-
-      elif d == 'BT':
-        intext = True
-
-      elif d == 'ET':
-        intext = False
-
-      elif d == 'cm':
-        assert(len(params) == 6 and params[1:3] == [0, 0])
-        transform = GraphicsMap(params[0], params[3], params[4], params[5])
-
-      elif d == 'w':
-        assert(len(params) == 1)
-        w = params[0]
-        if   stage == 2:
-          if   w == 0.4:  # Plot border followed by beat marker grid
-            linestate = 1
-          elif w == 0.3:  # Vertical grid followed by trace grid
-            linestate = 11
-        elif stage == 3:
-          if   w == 1.5:  # Calibration pulse
-            # 1mV for 0.2s
-            linestate = 21
-          elif w == 0.4:  # Trace
-            subtrace += 1
-            linestate = 22
-          elif w == 0.6:  # Beat marker
-            linestate = 23
-
-      elif d == 'm':
-        assert(len(params) == 2)
-        (x, y) = transform.map(params)
-        if   linestate == 1:   # Border
-          X_min = x
-        elif linestate == 2:   # Beat grid
-          origins_beats.append(y)
-        elif linestate == 12:  # Trace grid
-          origins_trace.append(y)
-        elif linestate == 22:  # In trace
-          if t_start is None:
-            t_start = x
-            times.append(0.0)
-          else:
-            t_start -= T_width
-            times.append(x - t_start)
-          trace.append(y - origins_trace[subtrace])
-        elif linestate >= 23:  # Beat markers
-          beats.append(x - t_start)
-
-      elif d == 'l':
-        assert(len(params) == 2)
-        (x, y) = transform.map(params)
-        if   linestate == 1:   # Border
-          if T_width is None:
-            X_max = x
-            T_width = X_max - X_min
-        elif linestate == 22:  # In trace
-          times.append(x - t_start)
-          trace.append(y - origins_trace[subtrace])
-
-      params = [ ]
-
-    self.ecg = (np.array(times), np.array(trace))
-    self.ecg[0].__imul__(POINTS2MM/T_scale)
-    self.ecg[1].__imul__(POINTS2MM/V_scale)
-
-    self.beats = np.array(beats)
-    self.beats.__imul__(POINTS2MM/T_scale)
+    self._set_ecg(*_Scanner(data).run())
 
 """
 BT    Begin text
@@ -313,27 +628,25 @@ ET    End text
 
 #==============================================================================
 
-if __name__ == '__main__':
-#-------------------------
+def process(pdf_path, repository, use_numba=False):
+#===================================================
+  '''
+  Save the ECG from an AliveCor PDF file as a BioSignalML HDF5 recording,
+  alongside the PDF file.
 
-  import logging
+  :param pdf_path: The AliveCor PDF file.
+  :param repository: The base URI of the recording's repository.
+  :param use_numba: Scan with the Numba kernel if the Cython scanner isn't
+    built. This only pays off when converting many files in one process.
+  '''
   import math
-  import sys, os
+  import os
 
-  from biosignalml.data import Clock, TimeSeries
+  from biosignalml.data import Clock
   from biosignalml.formats.hdf5 import HDF5Recording
   from biosignalml.units import UNITS
 
-  #==============================================================================
-
-  logging.basicConfig(format='%(asctime)s: %(message)s')
-  logging.getLogger().setLevel('DEBUG')
-
-  if len(sys.argv) < 2:
-    print("Usage: %s ALIVECOR_PDF_FILE" % sys.argv[0])
-    sys.exit(1)
-
-  pdf = ECG_PDF(sys.argv[1])
+  pdf = ECG_PDF(pdf_path, use_numba=use_numba)
 
 #  import matplotlib.pyplot as plt
 #  plt.plot(pdf.ecg.times, pdf.ecg.data)
@@ -341,8 +654,7 @@ if __name__ == '__main__':
 #           linestyle='None', marker='|', color='magenta')
 #  plt.show()
 
-  repository = 'http://demo.biosignalml.org'
-  basename = os.path.splitext(sys.argv[1])[0]
+  basename = os.path.splitext(pdf_path)[0]
 #  uri = 'file://' + os.path.abspath(basename)
   uri = repository + '/AliveCor/' + basename
   hdf5 = HDF5Recording.create(uri, basename + '.bsml', replace=True)
@@ -354,17 +666,38 @@ if __name__ == '__main__':
 
   beats = Clock(uri + '/beatclock', pdf.beats, units='seconds', label='Beat times')
   b = hdf5.new_signal(uri + '/beats', UNITS.AnnotationData, clock=beats, label='Beats')
-  b.extend(np.ones(len(pdf.beats)))
-  for n, t in enumerate(pdf.beats):
-    b_uri = uri + '/beat/%d' % n
-    hdf5.new_event(b_uri, 'http://biosignalml.org/AliveCor#beat', t,
-                   label = 'Beat %d' % n)
+  b.extend(np.ones(len(pdf.beats), dtype=np.int8))
+  beat_prefix = uri + '/beat/'
+  beat_uris = [ beat_prefix + str(n) for n in range(len(pdf.beats)) ]
+  beat_labels = [ 'Beat %d' % n for n in range(len(pdf.beats)) ]
+  beat_type = 'http://biosignalml.org/AliveCor#beat'
+  for (b_uri, t, label) in zip(beat_uris, pdf.beats.tolist(), beat_labels):
+    hdf5.new_event(b_uri, beat_type, t, label = label)
   hdf5.close()
 
 
   #beat_uri = uri + '/beats'
   #hdf5.create_clock(beat_uri, units='seconds', times=pdf.beats)
 
+#==============================================================================
+
+if __name__ == '__main__':
+#-------------------------
+
+  import logging
+  import sys
+
+  #==============================================================================
+
+  logging.basicConfig(format='%(asctime)s: %(message)s')
+  logging.getLogger().setLevel('DEBUG')
+
+  if len(sys.argv) < 2:
+    print("Usage: %s ALIVECOR_PDF_FILE" % sys.argv[0])
+    sys.exit(1)
+
+  process(sys.argv[1], 'http://demo.biosignalml.org')
+
 #==============================================================================
 
   """
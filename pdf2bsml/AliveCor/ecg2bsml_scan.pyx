@@ -0,0 +1,224 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+######################################################
+#
+#  BioSignalML Management in Python
+#
+#  Copyright (c) 2010-2013  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+######################################################
+
+'''
+A compiled version of the content stream interpreter in ``ecg2bsml.py``,
+which is used in its place when this module has been built with: ::
+
+  cythonize -i ecg2bsml_scan.pyx
+
+'''
+
+#==============================================================================
+
+from cpython.conversion cimport PyOS_string_to_double
+
+import numpy as np
+
+#==============================================================================
+
+cdef enum:
+  OP_OTHER, OP_q, OP_Q, OP_cm, OP_w, OP_m, OP_l
+
+#==============================================================================
+
+cdef inline bint _is_space(unsigned char c):
+#===========================================
+  return c == c' ' or c'\t' <= c <= c'\r'
+
+
+cdef bint _is_number(const unsigned char *s, Py_ssize_t n):
+#==========================================================
+  # The same as ``[-+]?(?:\d+\.?\d*|\.\d+)`` in ``ecg2bsml._TOKEN_RE``
+  cdef Py_ssize_t i = 0
+  cdef bint digits = False
+  cdef bint dot = False
+  if s[0] == c'-' or s[0] == c'+': i = 1
+  while i < n:
+    if   c'0' <= s[i] <= c'9': digits = True
+    elif s[i] == c'.' and not dot: dot = True
+    else: return False
+    i += 1
+  return digits
+
+
+cdef int _operator(const unsigned char *s, Py_ssize_t n):
+#========================================================
+  if n == 1:
+    if   s[0] == c'l': return OP_l
+    elif s[0] == c'm': return OP_m
+    elif s[0] == c'q': return OP_q
+    elif s[0] == c'Q': return OP_Q
+    elif s[0] == c'w': return OP_w
+  elif n == 2 and s[0] == c'c' and s[1] == c'm':
+    return OP_cm
+  return OP_OTHER
+
+#==============================================================================
+
+def scan_bytes(bytes data):
+#==========================
+  '''
+  Interpret the operators in a page's content stream.
+
+  :return: A tuple of ``times``, ``trace`` and ``beats`` arrays, in points, as
+           returned by ``ecg2bsml._interpret()``.
+  '''
+  cdef const unsigned char *s = data
+  cdef Py_ssize_t size = len(data)
+  cdef Py_ssize_t pos = 0
+  cdef Py_ssize_t start, n
+  cdef double params[6]
+  cdef Py_ssize_t nparams = 0
+  cdef char *end
+  cdef int op
+  cdef double Sx = 1.0, Sy = 1.0, Tx = 0.0, Ty = 0.0
+  cdef double x, y, w
+  cdef Py_ssize_t depth = 0
+  cdef int stage = 0, level = 0, linestate = 0
+  cdef Py_ssize_t subtrace = -1
+  cdef Py_ssize_t ntimes = 0, nbeats = 0, ntrace_origins = 0, nbeat_origins = 0
+  cdef double X_min = 0.0, T_width = 0.0, t_start = 0.0
+  cdef bint have_width = False, started = False
+
+  # Each point needs at least six bytes (``x y l ``)
+  capacity = (size + 1)//6 + 1
+  times_array = np.empty(capacity, np.float64)
+  trace_array = np.empty(capacity, np.float64)
+  beats_array = np.empty(capacity, np.float64)
+  cdef double[::1] times = times_array
+  cdef double[::1] trace = trace_array
+  cdef double[::1] beats = beats_array
+  cdef double[::1] origins_trace = np.empty(capacity, np.float64)
+  cdef double[::1] origins_beats = np.empty(capacity, np.float64)
+  cdef double[:, ::1] graphicstate = np.empty((64, 4), np.float64)
+
+  while True:
+    while pos < size and _is_space(s[pos]): pos += 1
+    if pos >= size: break
+    start = pos
+    while pos < size and not _is_space(s[pos]): pos += 1
+    n = pos - start
+
+    if _is_number(s + start, n):
+      if nparams < 6:   # Parsed independently of the C locale, unlike strtod()
+        params[nparams] = PyOS_string_to_double(<const char *>(s + start), &end, NULL)
+      nparams += 1
+      continue
+
+    op = _operator(s + start, n)
+    if   op == OP_l:
+      assert nparams == 2
+      x = Sx*params[0] + Tx
+      y = Sy*params[1] + Ty
+      if   linestate == 1:   # Border
+        if not have_width:
+          T_width = x - X_min
+          have_width = True
+      elif linestate == 22:  # In trace
+        assert 0 <= subtrace < ntrace_origins
+        times[ntimes] = x - t_start
+        trace[ntimes] = y - origins_trace[subtrace]
+        ntimes += 1
+
+    elif op == OP_q:
+      if depth == graphicstate.shape[0]:
+        graphicstate = np.concatenate((graphicstate, np.empty_like(graphicstate)))
+      graphicstate[depth, 0] = Sx
+      graphicstate[depth, 1] = Sy
+      graphicstate[depth, 2] = Tx
+      graphicstate[depth, 3] = Ty
+      depth += 1
+      Sx = 1.0
+      Sy = 1.0
+      Tx = 0.0
+      Ty = 0.0
+      if level == 0: stage += 1
+      level += 1
+
+    elif op == OP_Q:
+      assert depth > 0
+      depth -= 1
+      Sx = graphicstate[depth, 0]
+      Sy = graphicstate[depth, 1]
+      Tx = graphicstate[depth, 2]
+      Ty = graphicstate[depth, 3]
+      if linestate: linestate += 1
+      level -= 1
+
+    elif op == OP_cm:
+      assert nparams == 6 and params[1] == 0 and params[2] == 0
+      Sx = params[0]
+      Sy = params[3]
+      Tx = params[4]
+      Ty = params[5]
+
+    elif op == OP_w:
+      assert nparams == 1
+      w = params[0]
+      if   stage == 2:
+        if   w == 0.4:  # Plot border followed by beat marker grid
+          linestate = 1
+        elif w == 0.3:  # Vertical grid followed by trace grid
+          linestate = 11
+      elif stage == 3:
+        if   w == 1.5:  # Calibration pulse
+          linestate = 21
+        elif w == 0.4:  # Trace
+          subtrace += 1
+          linestate = 22
+        elif w == 0.6:  # Beat marker
+          linestate = 23
+
+    elif op == OP_m:
+      assert nparams == 2
+      x = Sx*params[0] + Tx
+      y = Sy*params[1] + Ty
+      if   linestate == 1:   # Border
+        X_min = x
+      elif linestate == 2:   # Beat grid
+        origins_beats[nbeat_origins] = y
+        nbeat_origins += 1
+      elif linestate == 12:  # Trace grid
+        origins_trace[ntrace_origins] = y
+        ntrace_origins += 1
+      elif linestate == 22:  # In trace
+        assert 0 <= subtrace < ntrace_origins
+        if not started:
+          t_start = x
+          started = True
+          times[ntimes] = 0.0
+        else:
+          assert have_width
+          t_start -= T_width
+          times[ntimes] = x - t_start
+        trace[ntimes] = y - origins_trace[subtrace]
+        ntimes += 1
+      elif linestate >= 23:  # Beat markers
+        assert started
+        beats[nbeats] = x - t_start
+        nbeats += 1
+
+    nparams = 0
+
+  return (times_array[:ntimes], trace_array[:ntimes], beats_array[:nbeats])
+
+#==============================================================================
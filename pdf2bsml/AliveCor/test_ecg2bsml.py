@@ -0,0 +1,171 @@
+######################################################
+#
+#  BioSignalML Management in Python
+#
+#  Copyright (c) 2010-2013  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+######################################################
+
+'''
+Check that every content stream scanner in ``ecg2bsml``, and ``ECG_PDF``
+using each of them, gives the same, known, result for the sample AliveCor
+PDFs.
+'''
+
+#==============================================================================
+
+import hashlib
+import os
+
+import numpy as np
+import pypdf
+import pytest
+
+import ecg2bsml
+
+#==============================================================================
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Number of trace points and beats, and SHA-256 digests of the ``times``,
+# ``trace`` and ``beats`` float64 arrays (in points) found by the original
+# scanner
+KNOWN = {
+  'ECG-20150623005143.pdf': (9004, 27,
+    'cff0f1f93c1b31cd513f596179665651310bed6094e02b8672b49f3c4477011a',
+    '72e28979910027fbeaf7d83d8e35e321dc8b90ff10c1b45786d5b147b9287ab7',
+    '4c7090a96b6b20f268524f8eb3c138745bba548cc405dca9a3b509cd3c3363c5'),
+  'ECG-20150715112243.pdf': (9004, 29,
+    'cff0f1f93c1b31cd513f596179665651310bed6094e02b8672b49f3c4477011a',
+    '2025083173530fb1b8bae7e87e590e7ebfe346dab6262e442e94012a10dad5e2',
+    '6d8784f66964eeb3443963183e3ae58d28de301eff3907199b8454b6627e4134'),
+  }
+
+#==============================================================================
+
+def _scan_python(data):
+#======================
+  return ecg2bsml._Scanner(data).run()
+
+def _scan_interpret(data):
+#=========================
+  return ecg2bsml._interpret(*ecg2bsml._tokenize(data))
+
+def _scan_numba(data):
+#=====================
+  interpret = ecg2bsml._jit_interpret()
+  if interpret is None:
+    pytest.skip('Numba is not installed')
+  return interpret(*ecg2bsml._tokenize(data))
+
+def _scan_cython(data):
+#======================
+  if ecg2bsml.scan_bytes is None:
+    pytest.skip('ecg2bsml_scan has not been built')
+  return ecg2bsml.scan_bytes(data)
+
+SCANNERS = [ _scan_python, _scan_interpret, _scan_numba, _scan_cython ]
+
+#==============================================================================
+
+def _content(pdf_file):
+#======================
+  with open(os.path.join(DATA, pdf_file), 'rb') as f:
+    return pypdf.PdfReader(f).pages[0].get_contents().get_data()
+
+
+@pytest.mark.parametrize('pdf_file', sorted(KNOWN))
+@pytest.mark.parametrize('scan', SCANNERS)
+def test_known_result(scan, pdf_file):
+#=====================================
+  (times, trace, beats) = scan(_content(pdf_file))
+  (ntimes, nbeats, *digests) = KNOWN[pdf_file]
+  assert (len(times), len(trace), len(beats)) == (ntimes, ntimes, nbeats)
+  assert [ hashlib.sha256(a.astype('<f8').tobytes()).hexdigest()
+             for a in (times, trace, beats) ] == digests
+
+
+# SHA-256 digests of ``ECG_PDF.ecg`` times and values, and of ``ECG_PDF.beats``,
+# as found originally
+KNOWN_ECG = {
+  'ECG-20150623005143.pdf': (
+    '573d634e5264dfd0151d1829a69b5c56f81e30d868f6ea216eea786e326586c9',
+    '5bd99169d69dd8028bd63f3ce5ba1289bb581c83e7f4b7537891441aae913e79',
+    'e8c0a55500ddf25b5a7003f6f3060e05abb6488b19a10387ed0b7b638899d72c'),
+  'ECG-20150715112243.pdf': (
+    '573d634e5264dfd0151d1829a69b5c56f81e30d868f6ea216eea786e326586c9',
+    'fa009e787737b92ed5e1e410bc5c7956ca4bfd9db403c3d13cbf774e955bbba1',
+    '23702148463ad63e54025d8693555ab8a6a113dd2c47303ac3bece962ed1e3ca'),
+  }
+
+@pytest.mark.parametrize('pdf_file', sorted(KNOWN_ECG))
+@pytest.mark.parametrize('scanner', [ 'python', 'numba', 'cython' ])
+def test_ecg_pdf(scanner, pdf_file, monkeypatch):
+#===============================================
+  if scanner == 'cython':
+    if ecg2bsml.scan_bytes is None:
+      pytest.skip('ecg2bsml_scan has not been built')
+  else:
+    monkeypatch.setattr(ecg2bsml, 'scan_bytes', None)
+    if scanner == 'numba' and ecg2bsml._jit_interpret() is None:
+      pytest.skip('Numba is not installed')
+  pdf = ecg2bsml.ECG_PDF(os.path.join(DATA, pdf_file), use_numba=(scanner == 'numba'))
+  results = (pdf.ecg[0], pdf.ecg[1], pdf.beats)
+  for a in results:
+    assert a.dtype == np.float64 and a.base is None
+  assert [ hashlib.sha256(a.tobytes()).hexdigest() for a in results ] == list(KNOWN_ECG[pdf_file])
+
+
+# The plot border and beat grid are drawn in a nested graphics block
+NESTED_BORDER = (
+  b'q Q q q 0.4 w q 1 0 0 1 0 0 cm 0 0 m 100 0 l S Q q 1 0 0 1 0 0 cm 0 5 m 100 5 l S Q Q '
+  b'0.3 w q 1 0 0 1 0 0 cm 10 0 m 10 9 l S Q '
+  b'q 1 0 0 1 0 0 cm 0 50 m 100 50 l 0 80 m 100 80 l S Q Q '
+  b'q 0.4 w q 1 0 0 1 0 0 cm 0 50 m 10 60 l 20 40 l S Q '
+  b'0.6 w q 1 0 0 1 0 0 cm 5 0 m 5 10 l S Q '
+  b'0.4 w q 1 0 0 1 0 0 cm 0 80 m 10 85 l S Q Q')
+
+@pytest.mark.parametrize('scan', SCANNERS)
+def test_nested_border(scan):
+#============================
+  (times, trace, beats) = scan(NESTED_BORDER)
+  assert times.tolist() == [ 0.0, 10.0, 20.0, 100.0, 110.0 ]
+  assert trace.tolist() == [ 0.0, 10.0, -10.0, 0.0, 5.0 ]
+  assert beats.tolist() == [ 5.0 ]
+
+
+# Stage 2 with only a vertical grid and a trace grid
+_TRACE_GRID = (b'q Q q 0.3 w q 1 0 0 1 0 0 cm 10 0 m 10 9 l S Q '
+               b'q 1 0 0 1 0 0 cm 0 50 m 100 50 l S Q Q ')
+
+# Streams which the original scanner fails on
+INVALID = {
+  'no trace grid':
+    b'q Q q Q q 0.4 w q 1 0 0 -1 10 20 cm 0 0 m 5 5 l S Q Q',
+  'no border':
+    _TRACE_GRID + b'q 0.4 w q 1 0 0 1 0 0 cm 0 50 m 10 60 l S Q '
+                  b'0.4 w q 1 0 0 1 0 0 cm 0 50 m 10 60 l S Q Q',
+  'beats before trace':
+    _TRACE_GRID + b'q 0.6 w q 1 0 0 1 0 0 cm 10 0 m 10 9 l S Q Q',
+  }
+
+@pytest.mark.parametrize('stream', sorted(INVALID))
+@pytest.mark.parametrize('scan', SCANNERS)
+def test_invalid_stream(scan, stream):
+#=====================================
+  with pytest.raises((AssertionError, IndexError, TypeError)):
+    scan(INVALID[stream])
+
+#==============================================================================